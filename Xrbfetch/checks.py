@@ -8,6 +8,7 @@
 
 import sys
 import biom
+import pandas as pd
 from Xrbfetch.io import write_summary, delete_files
 
 
@@ -21,7 +22,7 @@ def check_fetched_samples(metadata_sams: list, biom_tab: biom.Table) -> None:
         Feature table.
     """
     # get the sample names without the prep info number
-    sams = set(['.'.join(biom_sam.split('.')[:-1]) for biom_sam in biom_tab.ids(axis='sample')])
+    sams = {biom_sam.rsplit('.', 1)[0] for biom_sam in biom_tab.ids(axis='sample')}
     # get sample only present in metadata, i.e., not fetched
     only_meta = set(metadata_sams).difference(sams)
     if len(only_meta):
@@ -36,19 +37,17 @@ def check_replicates_amount(biom_tab: biom.Table) -> None:
     biom_tab : biom.Table
         Biom table.
     """
-    dups = {}
-    for sam in biom_tab.ids(axis='sample'):
-        dups.setdefault('.'.join(sam.split('.')[:-1]), []).append(sam)
+    # number of preps per sample ID (without prep number)
+    sams = pd.Series(biom_tab.ids(axis='sample'))
+    dups = sams.str.rsplit('.', n=1).str[0].value_counts()
+    dups = dups[dups > 1]
 
-    dups_to_print = {}
-    for sam, sams in dups.items():
-        if len(sams) > 1:
-            dups_to_print.setdefault(len(sams), []).append(sam)
-
-    if dups_to_print:
+    if dups.size:
+        # number of samples per number of replicates
+        dups_to_print = dups.value_counts().sort_values(kind='mergesort')
         print(' * Sample ID duplication (without prep number):')
-        for n, sams in sorted(dups_to_print.items(), key=lambda x: len(x[1])):
-            print('     --> %s samples have %s replicates' % (len(sams), n))
+        for n, n_sams in dups_to_print.items():
+            print('     --> %s samples have %s replicates' % (n_sams, n))
 
 
 def potential_stop(
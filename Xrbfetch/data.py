@@ -6,16 +6,45 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
+import re
 import biom
 import datetime
+import numpy as np
 import pandas as pd
-import pkg_resources
 
-from os.path import abspath, isfile, splitext
-from Xrbfetch.io import make_samples_list_tmp, run_fetch, read_json_ambiguities_file
+from functools import lru_cache
+from os.path import abspath, dirname, isfile, splitext
+from Xrbfetch.io import (
+    make_samples_list_tmp, run_fetch, read_json_ambiguities_file, read_bloom_sequences
+)
 
 
-RESOURCES = pkg_resources.resource_filename('Xrbfetch', 'resources')
+RESOURCES = '%s/resources' % dirname(abspath(__file__))
+BLOOM_SEQUENCES = '%s/newblooms.all.fasta' % RESOURCES
+CONTEXT_LENGTH = re.compile(r'-(\d+)nt-[^-]+$')
+
+
+@lru_cache(maxsize=32)
+def get_context_length(p_redbiom_context: str) -> int:
+    """
+    Get the length of the sequences of a redbiom context.
+
+    Parameters
+    ----------
+    p_redbiom_context : str
+        Redbiom context for fetching 16S data from Qiita
+        (e.g. 'Deblur-Illumina-16S-V4-150nt-780653').
+
+    Returns
+    -------
+    length : int
+        Length of the context sequences (None if not in the name).
+    """
+    length = None
+    context_length = CONTEXT_LENGTH.search(p_redbiom_context)
+    if context_length:
+        length = int(context_length.group(1))
+    return length
 
 
 def update_sample_name(
@@ -43,12 +72,10 @@ def update_sample_name(
         with samples re-named as per AGP system.
     """
     if update:
-        ids_map = {}
-        ids_res = []
-        for sam in biom_nodup.ids(axis='sample'):
-            updated_sam = sam.rsplit('.', 1)[0]
-            ids_res.append([sam, updated_sam])
-            ids_map[sam] = updated_sam
+        sams = pd.Index(biom_nodup.ids(axis='sample'))
+        # strip the prep number of all the sample IDs at once
+        updated_sams = sams.str.rsplit('.', n=1).str[0]
+        ids_map = dict(zip(sams, updated_sams))
         print('- Update sample name to remove prep file info... ', end='')
         biom_nodup.update_ids(id_map=ids_map, axis='sample', inplace=True)
         print('Done')
@@ -58,8 +85,8 @@ def update_sample_name(
 def merge_read_features_counts(
         metadata: pd.DataFrame,
         biom_tab_no_ambi: biom.Table,
-        read_counts: dict,
-        feat_counts: dict) -> pd.DataFrame:
+        read_counts: pd.Series,
+        feat_counts: pd.Series) -> pd.DataFrame:
     """
     Filter to a minimum number of reads.
 
@@ -69,9 +96,9 @@ def merge_read_features_counts(
         Metadata for the included samples only.
     biom_tab_no_ambi : biom.table
         The biom table without ambiguous samples.
-    read_counts : dict
+    read_counts : pd.Series or dict
         Number of reads per sample.
-    feat_counts : dict
+    feat_counts : pd.Series or dict
         Number of features per sample.
 
     Returns
@@ -83,30 +110,76 @@ def merge_read_features_counts(
     ids = biom_tab_no_ambi.ids(axis='sample')
     # get sample IDs and reads/features counts
     # removed from the metadata if present
-    columns = ['sample_name']
-    for col in ['qiita_prep_id', 'read_count',
-                'feature_count', 'orig_sample_name']:
-        if col in metadata.columns:
-            metadata.drop(columns=col, inplace=True)
-        columns.append(col)
+    columns = ['sample_name', 'qiita_prep_id', 'read_count',
+               'feature_count', 'orig_sample_name']
+    to_drop = [col for col in columns[1:] if col in metadata.columns]
+    if to_drop:
+        metadata = metadata.drop(columns=to_drop)
 
     # re-create these IDs and reads/features counts afresh
-    ids_read_feat_counts_pd = pd.DataFrame([
-        [
-            ID.rsplit('.', 1)[0],  # sample ID without prep number
-            ID.split('.')[-1],     # prep number
-            read_counts[ID],       # read number
-            feat_counts[ID],       # feature number
-            ID                     # full sample ID
-        ] for ID in ids],
-        columns=columns
-    )
-    # merge these fresh values back into the metadata
-    metadata_counts = metadata.merge(
-        ids_read_feat_counts_pd, on='sample_name', how='right')
+    ids = pd.Index(ids)
+    ids_split = ids.str.rsplit('.', n=1, expand=True)
+    ids_read_feat_counts_pd = pd.DataFrame({
+        # sample ID without prep number
+        'sample_name': ids_split.get_level_values(0),
+        # prep number
+        'qiita_prep_id': ids_split.get_level_values(1),
+        # read number
+        'read_count': pd.Series(read_counts).reindex(ids).values.astype(np.int64),
+        # feature number
+        'feature_count': pd.Series(feat_counts).reindex(ids).values.astype(np.int64),
+        # full sample ID
+        'orig_sample_name': ids
+    }, columns=columns)
+    # merge these fresh values back into the metadata (on the index)
+    metadata_counts = metadata.set_index('sample_name').join(
+        ids_read_feat_counts_pd.set_index('sample_name'), how='right'
+    ).reset_index()
     return metadata_counts
 
 
+def subset_samples(
+        biom_tab: biom.Table,
+        ids_to_keep) -> biom.Table:
+    """
+    Keep the given samples and the features still present
+    in these samples (filter + remove_empty in one pass).
+
+    Parameters
+    ----------
+    biom_tab : biom.Table
+        Feature table.
+    ids_to_keep : list-like
+        Sample IDs to keep.
+
+    Returns
+    -------
+    biom_sub : biom.Table
+        Feature table for the kept samples and without
+        the features that are absent from these samples.
+    """
+    sam_ids = biom_tab.ids(axis='sample')
+    obs_ids = biom_tab.ids(axis='observation')
+    keep_sams = pd.Index(sam_ids).isin(ids_to_keep)
+    # slicing returns a new matrix: safe to drop its explicit zeros
+    mat = biom_tab.matrix_data.tocsc()[:, keep_sams]
+    mat.eliminate_zeros()
+    keep_obs = mat.getnnz(axis=1) > 0
+
+    sam_md = biom_tab.metadata(axis='sample')
+    if sam_md is not None:
+        sam_md = [md for md, keep in zip(sam_md, keep_sams) if keep]
+    obs_md = biom_tab.metadata(axis='observation')
+    if obs_md is not None:
+        obs_md = [md for md, keep in zip(obs_md, keep_obs) if keep]
+
+    biom_sub = biom.Table(
+        mat[keep_obs, :], obs_ids[keep_obs], sam_ids[keep_sams],
+        observation_metadata=obs_md, sample_metadata=sam_md,
+        table_id=biom_tab.table_id)
+    return biom_sub
+
+
 def filter_reads(
         metadata_counts: pd.DataFrame,
         biom_tab_no_ambi: biom.Table,
@@ -135,14 +208,9 @@ def filter_reads(
     # Filter to keep only the samples with min number reads
     print('- Filter biom for min %s reads per sample... ' % reads_filter, end='')
     metadata_filt = metadata_counts.loc[
-        metadata_counts['read_count'] >= reads_filter].copy()
-    biom_tab_filt = biom_tab_no_ambi.filter(
-        ids_to_keep=metadata_filt['orig_sample_name'].tolist(),
-        axis='sample'
-    ).copy()
-    biom_tab_filt.remove_empty(
-        axis='observation', inplace=True
-    )
+        metadata_counts['read_count'] >= reads_filter]
+    biom_tab_filt = subset_samples(
+        biom_tab_no_ambi, metadata_filt['orig_sample_name'].values)
     print('Done -> %s samples' % biom_tab_filt.shape[1])
     return biom_tab_filt, metadata_filt
 
@@ -152,7 +220,8 @@ def run_redbiom_fetch(
         m_metadata_file: str,
         o_metadata_file: str,
         p_redbiom_context: str,
-        force: bool) -> tuple:
+        force: bool,
+        p_threads: int = 1) -> tuple:
     """
     Fetch the samples using RedBiom.
 
@@ -166,6 +235,10 @@ def run_redbiom_fetch(
         Path to output metadata for the included samples only.
     p_redbiom_context : str
         Redbiom context for fetching 16S data from Qiita.
+    force : bool
+        Re-fetch and not use an 'already-fetched' table.
+    p_threads : int
+        Number of concurrent redbiom fetches (on chunks of samples).
 
     Returns
     -------
@@ -186,7 +259,7 @@ def run_redbiom_fetch(
 
         redbiom_samples = make_samples_list_tmp(m_metadata_file, metadata, context, timetoken)
         print('Fetching %s samples from redbiom... ' % metadata.shape[0], end='')
-        run_fetch(redbiom_samples, context, redbiom_output)
+        run_fetch(redbiom_samples, context, redbiom_output, p_threads)
         print('Done')
 
     return redbiom_output, redbiom_samples
@@ -212,26 +285,20 @@ def remove_blooms(
     -------
     biom_tab : biom.table
         Feature table retrieved from redbiom, without blooms.
-    biom_tab_removed_ids : list
-        Samples ids removed as bloom dropouts.
     """
 
-    bloom_sequences_fp = '%s/newblooms.all.fasta' % RESOURCES
+    bloom_sequences_fp = BLOOM_SEQUENCES
     if p_bloom_sequences:
-        bloom_sequences_fp = abspath(p_bloom_sequences)
-    bloom_seqs = set([x.strip()[:length] for x in open(
-        bloom_sequences_fp).readlines() if x[0] != '>'])
+        bloom_sequences_fp = p_bloom_sequences
+    bloom_seqs = read_bloom_sequences(bloom_sequences_fp, length)
 
-    in_out = {'in': [], 'out': []}
-    for feature in biom_tab.ids(axis='observation'):
-        if feature in bloom_seqs:
-            in_out['in'].append(feature)
-        else:
-            in_out['out'].append(feature)
+    # features that are not bloom sequences
+    features = biom_tab.ids(axis='observation')
+    is_bloom = pd.Index(features).isin(bloom_seqs)
 
     print('- Filter blooms... ', end='')
     biom_tab.filter(
-        ids_to_keep=in_out['out'],
+        ids_to_keep=features[~is_bloom],
         axis='observation',
         inplace=True
     )
@@ -254,76 +321,70 @@ def get_reads_features_counts(
 
     Returns
     -------
-    ids_read_counts : dict
+    ids_read_counts : pd.Series
         Number of reads per sample.
-    ids_feat_counts : dict
+    ids_feat_counts : pd.Series
         Number of features per sample.
     """
     ids = biom_tab.ids(axis='sample')
-    read_counts = biom_tab.sum(axis='sample')
-    ids_read_counts = dict((ids[x], read_counts[x]) for x in range(len(ids)))
-    feat_counts = biom_tab.nonzero_counts(axis='sample', binary=True)
-    ids_feat_counts = dict((ids[x], feat_counts[x]) for x in range(len(ids)))
+    # samples are the columns: get the sample of each stored value
+    # to reduce both counts from the same sparse arrays
+    mat = biom_tab.matrix_data.tocsc()
+    n_sams = mat.shape[1]
+    sams = np.repeat(np.arange(n_sams), np.diff(mat.indptr))
+    read_counts = np.bincount(sams, weights=mat.data, minlength=n_sams)
+    ids_read_counts = pd.Series(read_counts, index=ids)
+    feat_counts = np.bincount(sams[mat.data != 0], minlength=n_sams)
+    ids_feat_counts = pd.Series(feat_counts, index=ids)
     return ids_read_counts, ids_feat_counts
 
 
-def reverse_json_ambi(
+def get_best_ambiguous_samples(
         json_ambi: dict,
-        ids: set) -> dict:
+        ids: pd.Index,
+        read_counts: pd.Series,
+        feat_counts: pd.Series) -> list:
     """
-    Reverse a dict (values as keys, keys as list values).
+    Get the prep sample that has the most reads
+    (or for ties, the most features) for each
+    of the samples in the redbiom ambiguities.
 
     Parameters
     ----------
     json_ambi : dict
-        A dict having one string value per key.
-    ids : set
+        Sample name per prep sample ID.
+    ids : pd.Index
         sample IDs from the biom table.
+    read_counts : pd.Series or dict
+        Number of reads per sample.
+    feat_counts : pd.Series or dict
+        Number of features per sample.
 
     Returns
     -------
-    json_ambi_rev : dict
-        A dict having the input key(s) in lists
-        as values to the input values as keys.
-    """
-    json_ambi_rev = {}
-    for k, v in json_ambi.items():
-        if k in ids:
-            json_ambi_rev.setdefault(v, []).append(k)
-    return json_ambi_rev
-
-
-def get_most_read_or_features(
-        amb_sams: list,
-        counts: dict) -> list:
-    """
-    Get the samples that have the most
-    counts (reads of features).
-
-    Parameters
-    ----------
-    amb_sams : list
-        Sample IDs.
-    counts : dict
-        Count per Sample ID.
-
-    Returns
-    -------
-    cur_best_samples : list
-        Selected samples (with max reads/features).
+    best_samples : list
+        Selected prep sample per ambiguous sample.
     """
-    cur_counts = dict((amb_sam, counts[amb_sam]) for amb_sam in amb_sams)
-    count_max = max(cur_counts.values())
-    cur_best_samples = [amb_sam for amb_sam in amb_sams
-                        if cur_counts[amb_sam] == count_max]
-    return cur_best_samples
+    if not json_ambi:
+        return []
+    # one row per prep sample: (prep sample ID, sample name)
+    amb_pd = pd.Series(json_ambi, name='sample_name').rename_axis(
+        'amb_sample_name').reset_index()
+    amb_pd = amb_pd.loc[amb_pd['amb_sample_name'].isin(ids)].copy()
+    amb_pd['read_count'] = amb_pd['amb_sample_name'].map(read_counts)
+    amb_pd['feature_count'] = amb_pd['amb_sample_name'].map(feat_counts)
+    # most reads first, then most features (stable for the remaining ties)
+    best_samples = amb_pd.sort_values(
+        ['read_count', 'feature_count'], ascending=False
+    ).drop_duplicates('sample_name')['amb_sample_name'].tolist()
+    return best_samples
 
 
 def solve_ambiguous_preps(
         redbiom_output: str,
         biom_tab: biom.Table,
-        read_counts: dict,
-        feat_counts: dict) -> biom.Table:
+        read_counts: pd.Series,
+        feat_counts: pd.Series) -> biom.Table:
     """
     Pick the best prep sample per sample to
     solve the ambiguous fetched results.
@@ -334,9 +395,9 @@ def solve_ambiguous_preps(
         The biom table returned by redbiom.
     biom_tab : biom.Table
         Current data retrieved from redbiom, without blooms.
-    read_counts : dict
+    read_counts : pd.Series or dict
         Number of reads per sample.
-    feat_counts : dict
+    feat_counts : pd.Series or dict
         Number of features per sample.
 
     Returns
@@ -346,28 +407,23 @@ def solve_ambiguous_preps(
     """
     # read the ambiguities
     json_ambi = read_json_ambiguities_file(redbiom_output)
-    ids = set(biom_tab.ids(axis='sample'))
-    json_ambi_rev = reverse_json_ambi(json_ambi, ids)
+    ids = pd.Index(biom_tab.ids(axis='sample'))
 
-    best_samples = []
-    if json_ambi_rev:
+    best_samples = get_best_ambiguous_samples(
+        json_ambi, ids, read_counts, feat_counts)
+    # only report the ambiguities that concern the table's samples
+    if best_samples:
         print('- Get best samples from ambiguous redbiom results... ', end='')
-        # for each sample and its list of preps version
-        for sam, amb_sams in json_ambi_rev.items():
-            cur_best_samples = get_most_read_or_features(amb_sams, read_counts)
-            if len(cur_best_samples) > 1:
-                # if >1 samples have same amount of
-                # reads, take that with the most features
-                cur_best_samples = get_most_read_or_features(cur_best_samples, feat_counts)
-            best_samples.append(cur_best_samples[0])
         print('Done -> %s ambiguous samples' % len(best_samples))
 
-    best_samples_noprep = set([best_sample.rsplit('.', 1)[0] for best_sample in best_samples])
-    non_ambiguous = [i for i in ids if i.rsplit('.', 1)[0] not in best_samples_noprep]
+    # samples IDs without prep number
+    best_samples_noprep = pd.Index(best_samples, dtype=object).str.rsplit('.', n=1).str[0]
+    ids_noprep = ids.str.rsplit('.', n=1).str[0]
+    non_ambiguous = ids[~ids_noprep.isin(best_samples_noprep)]
 
-    ids_to_keep = best_samples + non_ambiguous
+    ids_to_keep = np.concatenate([
+        np.asarray(best_samples, dtype=object), non_ambiguous.values])
     print('- Non-ambiguous + best of ambiguous ', end='')
-    biom_tab.filter(ids_to_keep=ids_to_keep, axis='sample', inplace=True)
-    biom_tab.remove_empty(axis='observation', inplace=True)
+    biom_tab_no_ambi = subset_samples(biom_tab, ids_to_keep)
     print('Done -> %s samples' % len(ids_to_keep))
-    return biom_tab
+    return biom_tab_no_ambi
@@ -7,8 +7,11 @@
 # ----------------------------------------------------------------------------
 
 import biom
+import numpy as np
 import pandas as pd
 
+from Xrbfetch.data import subset_samples
+
 
 def add_edit_and_working_sample_name(
         metadata_filt: pd.DataFrame) -> pd.DataFrame:
@@ -27,24 +30,25 @@ def add_edit_and_working_sample_name(
         new, renamed samples names (for checking
         duplicates).
     """
-    metadata_edit = metadata_filt.copy()
-
-    edit_sample_names = []
-    working_sample_names = []
-    for sam in metadata_edit['orig_sample_name']:
-        sam_agp = sam.split('.')[1]
-        if sam_agp.isdigit():
-            edit_sample_names.append(sam)
-            working_sample_names.append(str(int(sam_agp)))
-        else:
-            sam_edit = '%s.%s.%s' % (sam.split('.')[0],
-                                     sam_agp[:-1],
-                                     sam.split('.')[-1])
-            edit_sample_names.append(sam_edit)
-            working_sample_names.append(sam_agp[:-1])
-
-    metadata_edit['edit_sample_name'] = edit_sample_names
-    metadata_edit['working_sample_name'] = working_sample_names
+    # split all the sample names at once: study.agp[...].prep
+    orig_sample_names = metadata_filt['orig_sample_name']
+    parts = orig_sample_names.str.split('.', n=2, expand=True)
+    prep = orig_sample_names.str.rsplit('.', n=1).str[-1]
+    is_digit = parts[1].str.isdigit()
+    trimmed = parts[1].str.slice(0, -1)
+
+    # only the numeric names lose their leading zeros (e.g. not 'BLANK')
+    working_sample_names = parts[1].where(is_digit, trimmed)
+    is_number = working_sample_names.str.isdigit()
+    working_sample_names = working_sample_names.where(
+        ~is_number, working_sample_names[is_number].astype(int).astype(str))
+
+    metadata_edit = metadata_filt.assign(
+        edit_sample_name=np.where(
+            is_digit, orig_sample_names,
+            parts[0].str.cat([trimmed, prep], sep='.')),
+        working_sample_name=working_sample_names
+    )
     return metadata_edit
 
 
@@ -64,24 +68,13 @@ def add_edit_and_working_sample_name(
 #         and with a min number of reads per sample and
 #         with only one sample per host and per sample
 #     """
-#     metadata_edit_best = metadata_edit_host.copy()
-#     best_samples = []
 #     print('- Keep the best working_sample_name per sample... ', end='')
-#     for working_sample_name, subtab in metadata_edit_best.groupby('working_sample_name'):
-#         curr_subtab = subtab[['read_count', 'feature_count', 'edit_sample_name']]
-#         max_read_count_sample = curr_subtab.loc[curr_subtab.read_count == max(curr_subtab.read_count)]
-#         if max_read_count_sample.shape[0] > 1:
-#             max_feat_count_sample = max_read_count_sample.loc[
-#                 max_read_count_sample.feature_count == max(max_read_count_sample.feature_count)]
-#             max_feat_count_sample.sort_values('feature_count', ascending=False, inplace=True)
-#             best_sample = str(next(iter(max_feat_count_sample.edit_sample_name), 'no match'))
-#         else:
-#             best_sample = str(next(iter(max_read_count_sample.edit_sample_name), 'no match'))
-#         best_samples.append(best_sample)
-#
-#     metadata_edit_best_out = metadata_edit_best.loc[metadata_edit_best['edit_sample_name'].isin(best_samples)]
-#     print('Done -> %s samples' % metadata_edit_best_out.shape[0])
-#     return metadata_edit_best_out
+#     metadata_edit_best = metadata_edit_host.sort_values(
+#         ['read_count', 'feature_count'],
+#         ascending=False
+#     ).drop_duplicates('working_sample_name', keep='first')
+#     print('Done -> %s samples' % metadata_edit_best.shape[0])
+#     return metadata_edit_best
 
 
 def keep_the_best_host_subject_id_sample(
@@ -102,17 +95,20 @@ def keep_the_best_host_subject_id_sample(
         and with a min number of reads per sample and
         with only one sample per host.
     """
-    metadata_edit_host = metadata_edit.copy()
-    if max(metadata_edit_host.host_subject_id.value_counts()) == 1:
+    metadata_edit_host = metadata_edit
+    # samples of the hosts that have more than one sample
+    dup_hosts = metadata_edit.host_subject_id.duplicated(keep=False)
+    if not dup_hosts.any():
         print('- Already one sample per host_subject_id ', end='')
     else:
         print('- Keep the best sample per host_subject_id... ', end='')
-        metadata_edit_host.sort_values(
+        # only sort the samples of these hosts
+        best_dups = metadata_edit.loc[dup_hosts].sort_values(
             ['read_count', 'feature_count'],
-            ascending=False,
-            inplace=True)
-        metadata_edit_host = metadata_edit_host[
-            ~metadata_edit_host.host_subject_id.duplicated()]
+            ascending=False
+        ).drop_duplicates('host_subject_id', keep='first')
+        metadata_edit_host = metadata_edit.loc[
+            ~dup_hosts | metadata_edit.index.isin(best_dups.index)]
     print('Done -> %s samples' % metadata_edit_host.shape[0])
     return metadata_edit_host
 
@@ -145,10 +141,8 @@ def remove_duplicates(
     """
     metadata_edit = add_edit_and_working_sample_name(metadata_filt)
     if unique:
-        metadata_edit = keep_the_best_host_subject_id_sample(metadata_filt)
-    # metadata_edit = keep_the_best_root_sample_name_sample(metadata_filt)
-    biom_nodup = biom_tab_filt.filter(
-        ids_to_keep=metadata_edit['orig_sample_name'].tolist(),
-        axis='sample').copy()
-    biom_nodup.remove_empty(axis='observation', inplace=True)
+        metadata_edit = keep_the_best_host_subject_id_sample(metadata_edit)
+    # metadata_edit = keep_the_best_root_sample_name_sample(metadata_edit)
+    biom_nodup = subset_samples(
+        biom_tab_filt, metadata_edit['orig_sample_name'].values)
     return biom_nodup, metadata_edit
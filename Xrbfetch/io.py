@@ -9,11 +9,16 @@
 import os
 import json
 import biom
+import h5py
+import hashlib
 import subprocess
 import pandas as pd
 
-from biom.util import biom_open
-from os.path import dirname, isdir, isfile, splitext
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from os.path import dirname, expanduser, getmtime, isfile, splitext
+
+CACHE = expanduser('~/.cache/xrbfetch')
 
 
 def get_outputs(metadata_edit_best: pd.DataFrame,
@@ -51,12 +56,76 @@ def get_outputs(metadata_edit_best: pd.DataFrame,
     return o_metadata_file, o_biom_file
 
 
+def write_metadata(
+        metadata: pd.DataFrame,
+        o_metadata_file: str,
+        index: bool = False) -> None:
+    """
+    Write a metadata table to a tab-separated file.
+
+    Parameters
+    ----------
+    metadata : pd.DataFrame
+        Metadata table.
+    o_metadata_file : str
+        Path to the output metadata table file.
+    index : bool
+        Whether to write the index as first column or not.
+    """
+    # format by blocks of rows and flush in large writes
+    with open(o_metadata_file, 'w', buffering=1 << 20, newline='') as o:
+        metadata.to_csv(o, index=index, sep='\t', chunksize=50000)
+
+
+def open_biom_write(o_biom_file: str) -> h5py.File:
+    """
+    Open a hdf5 file for writing a biom table,
+    with a larger chunk cache than the h5py default (1 MiB).
+
+    Parameters
+    ----------
+    o_biom_file : str
+        Path to the output biom table file.
+
+    Returns
+    -------
+    o_biom_file_handle : h5py.File
+        Handle to the output biom table file.
+    """
+    # chunk cache parameters need h5py >= 2.9
+    o_biom_file_handle = h5py.File(
+        o_biom_file, 'w', rdcc_nbytes=64 * 1024 * 1024,
+        rdcc_nslots=1000003, rdcc_w0=0.75)
+    return o_biom_file_handle
+
+
+def write_biom(
+        biom_tab: biom.Table,
+        o_biom_file: str,
+        compress: bool = False) -> None:
+    """
+    Write a biom table to a hdf5 file.
+
+    Parameters
+    ----------
+    biom_tab : biom.Table
+        Feature table.
+    o_biom_file : str
+        Path to the output biom table file.
+    compress : bool
+        Whether to gzip-compress the biom datasets or not.
+    """
+    with open_biom_write(o_biom_file) as f:
+        biom_tab.to_hdf5(f, 'Xrbfetch', compress=compress)
+
+
 def write_outputs(
         o_biom_file: str,
         o_metadata_file: str,
         biom_updated: biom.Table,
         metadata_edit_best: pd.DataFrame,
-        dim: bool = False) -> None:
+        dim: bool = False,
+        compress: bool = False) -> None:
     """
     Write the metadata and the biom table outputs.
 
@@ -76,6 +145,9 @@ def write_outputs(
     dim : bool
         Whether to add the number of samples in the
         final biom file name before extension or not.
+    compress : bool
+        Whether to gzip-compress the biom datasets or not
+        (uncompressed is much faster to write).
     """
     if dim:
         o_metadata_file, o_biom_file = get_outputs(
@@ -84,16 +156,19 @@ def write_outputs(
     if biom_updated.shape[0]:
         print('Outputs:')
         if o_metadata_file[0] == '/':
-            if not isdir(dirname(o_metadata_file)):
-                os.makedirs(dirname(o_metadata_file))
-        metadata_edit_best.to_csv(o_metadata_file, index=False, sep='\t')
-        print(o_metadata_file)
-
-        if not isdir(dirname(o_biom_file)):
-            os.makedirs(dirname(o_biom_file))
-        with biom_open(o_biom_file, 'w') as f:
-            biom_updated.to_hdf5(f, 'Xrbfetch')
-        print(o_biom_file)
+            os.makedirs(dirname(o_metadata_file), exist_ok=True)
+        if dirname(o_biom_file):
+            os.makedirs(dirname(o_biom_file), exist_ok=True)
+        # separate files: write the metadata and the biom table concurrently
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            metadata_written = executor.submit(
+                write_metadata, metadata_edit_best, o_metadata_file)
+            biom_written = executor.submit(
+                write_biom, biom_updated, o_biom_file, compress)
+            metadata_written.result()
+            print(o_metadata_file)
+            biom_written.result()
+            print(o_biom_file)
 
 
 def read_biom(redbiom_output: str) -> biom.Table:
@@ -118,6 +193,85 @@ def read_biom(redbiom_output: str) -> biom.Table:
     return biom_tab
 
 
+@lru_cache(maxsize=8)
+def parse_bloom_sequences(
+        bloom_sequences_fp: str,
+        mtime: float,
+        length: int) -> frozenset:
+    """
+    Parse the sequences of a fasta file (cached).
+
+    Parameters
+    ----------
+    bloom_sequences_fp : str
+        Path to the fasta file containing the bloom sequences.
+    mtime : float
+        Modification time of the fasta file (part of the cache key).
+    length : int
+        Length to which the sequences are trimmed (None: no trimming).
+
+    Returns
+    -------
+    bloom_seqs : frozenset
+        Bloom sequences.
+    """
+    try:
+        # C parser: the '>' header lines are skipped as comments
+        seqs = pd.read_csv(bloom_sequences_fp, header=None, names=['seq'],
+                           dtype=str, comment='>', engine='c')['seq']
+    except pd.errors.EmptyDataError:
+        return frozenset()
+    seqs = seqs.str.strip()
+    if length:
+        seqs = seqs.str[:length]
+    bloom_seqs = frozenset(seqs.values)
+    return bloom_seqs
+
+
+def read_bloom_sequences(
+        bloom_sequences_fp: str,
+        length: int = None) -> frozenset:
+    """
+    Read the bloom sequences, only parsing the file again if it changed.
+
+    Parameters
+    ----------
+    bloom_sequences_fp : str
+        Path to the fasta file containing the bloom sequences.
+    length : int
+        Length to which the sequences are trimmed (None: no trimming).
+
+    Returns
+    -------
+    bloom_seqs : frozenset
+        Bloom sequences.
+    """
+    return parse_bloom_sequences(
+        bloom_sequences_fp, getmtime(bloom_sequences_fp), length)
+
+
+def read_tsv(tsv_file: str, index_col: int = None) -> pd.DataFrame:
+    """
+    Read a tab-separated file with all values as strings.
+
+    Parameters
+    ----------
+    tsv_file : str
+        Path to a tab-separated file.
+    index_col : int
+        Column to use as index (None: default range index).
+
+    Returns
+    -------
+    tsv_pd : pd.DataFrame
+        Table of strings.
+    """
+    # C parser: dtype=str keeps the values as written (e.g. leading zeros)
+    tsv_pd = pd.read_csv(tsv_file, sep='\t', dtype=str, index_col=index_col,
+                         engine='c', low_memory=False)
+    return tsv_pd
+
+
 def read_meta_pd(metadata_file: str) -> pd.DataFrame:
     """
     Read metadata with first column as index.
@@ -132,11 +286,11 @@ def read_meta_pd(metadata_file: str) -> pd.DataFrame:
     metadata : pd.DataFrame
         Metadata table.
     """
-    metadata = pd.read_table(metadata_file, dtype=str)
-    metadata.rename(columns={metadata.columns.tolist()[0]: 'sample_name'}, inplace=True)
-    metadata.columns = [x.lower() for x in metadata.columns]
+    metadata = read_tsv(metadata_file)
+    metadata.rename(columns={metadata.columns[0]: 'sample_name'}, inplace=True)
+    metadata.columns = metadata.columns.str.lower()
     # remove NaN only columns
-    metadata = metadata.loc[:, ~metadata.isna().all()]
+    metadata.dropna(axis=1, how='all', inplace=True)
     return metadata
 
 
@@ -169,27 +323,35 @@ def make_samples_list_tmp(m_metadata_file: str,
     redbiom_samples = '%s_redbiom_sams_%s_%s.tmp' % (
         splitext(m_metadata_file)[0], context, timetoken)
     with open(redbiom_samples, 'w') as o:
-        for feature_name in metadata.sample_name:
-            o.write('%s\n' % feature_name)
+        o.write(''.join(metadata.sample_name.astype(str) + '\n'))
     return redbiom_samples
 
 
-def run_fetch(
+def fetch_cmd(
         redbiom_samples: str,
         context: str,
-        redbiom_output: str) -> None:
+        redbiom_output: str) -> list:
     """
-    Delete intermediate metadata files.
+    Run the redbiom fetch command line.
 
     Parameters
     ----------
     redbiom_samples : str
-        Path to metadata file containing
-        the samples ot fetch and filter.
+        Path to the file containing the samples to fetch.
     context : str
         redbiom context name.
     redbiom_output : str
         Path to the fetched biom file.
+
+    Returns
+    -------
+    cmd : list
+        The redbiom command that was run.
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        If redbiom exits with an error.
     """
     cmd = [
         'redbiom', 'fetch', 'samples',
@@ -197,8 +359,80 @@ def run_fetch(
         '--context', context,
         '--output', redbiom_output
     ]
-    subprocess.call(cmd)
-    print(' '.join(cmd))
+    subprocess.run(cmd, check=True)
+    return cmd
+
+
+def run_fetch(
+        redbiom_samples: str,
+        context: str,
+        redbiom_output: str,
+        threads: int = 1) -> None:
+    """
+    Fetch the samples using the redbiom command line,
+    possibly in parallel for chunks of the samples list.
+
+    Parameters
+    ----------
+    redbiom_samples : str
+        Path to metadata file containing
+        the samples ot fetch and filter.
+    context : str
+        redbiom context name.
+    redbiom_output : str
+        Path to the fetched biom file.
+    threads : int
+        Number of concurrent redbiom fetches.
+
+    Raises
+    ------
+    IOError
+        If a chunk's fetched biom file was not written.
+    """
+    with open(redbiom_samples) as f:
+        samples = f.readlines()
+    n_chunks = min(threads, len(samples))
+    if n_chunks < 2:
+        cmd = fetch_cmd(redbiom_samples, context, redbiom_output)
+        print(' '.join(cmd))
+        return
+
+    # one samples list and one fetched biom per chunk
+    chunk_size = -(-len(samples) // n_chunks)
+    chunks_samples, chunks_outputs = [], []
+    for idx, start in enumerate(range(0, len(samples), chunk_size)):
+        chunk_samples = '%s_%s.tmp' % (splitext(redbiom_samples)[0], idx)
+        with open(chunk_samples, 'w') as o:
+            o.write(''.join(samples[start:start + chunk_size]))
+        chunks_samples.append(chunk_samples)
+        chunks_outputs.append('%s_%s.biom' % (splitext(redbiom_output)[0], idx))
+
+    try:
+        # fetching is network-bound: run the chunks concurrently
+        with ThreadPoolExecutor(max_workers=len(chunks_samples)) as executor:
+            cmds = list(executor.map(
+                fetch_cmd, chunks_samples,
+                [context] * len(chunks_samples), chunks_outputs))
+        for cmd in cmds:
+            print(' '.join(cmd))
+        missing = [x for x in chunks_outputs if not isfile(x)]
+        if missing:
+            raise IOError('redbiom did not write the fetched samples to:\n%s'
+                          % '\n'.join(missing))
+
+        # merge the chunks' tables (disjoint samples) and ambiguities
+        tabs = [biom.load_table(x) for x in chunks_outputs]
+        biom_tab = tabs[0].concat(tabs[1:], axis='sample')
+        write_biom(biom_tab, redbiom_output)
+        json_ambi = {}
+        for chunk_output in chunks_outputs:
+            json_ambi.update(read_json_ambiguities_file(chunk_output))
+        if json_ambi:
+            with open('%s.ambiguities' % redbiom_output, 'w') as o:
+                json.dump(json_ambi, o)
+    finally:
+        for chunk_output, chunk_samples in zip(chunks_outputs, chunks_samples):
+            delete_files(chunk_output, chunk_samples)
 
 
 def delete_files(
@@ -239,11 +473,83 @@ def write_summary(
     """
     with open(o_summary_file, 'w') as o:
         o.write('steps\tsamples\n')
-        for step, num in summary:
-            o.write('%s\t%s\n' % (step, num))
+        o.writelines('%s\t%s\n' % (step, num) for step, num in summary)
     print(o_summary_file)
 
 
+def get_fetch_cache(
+        ids,
+        context: str) -> str:
+    """
+    Get the path to the cached redbiom fetch of samples.
+
+    Parameters
+    ----------
+    ids : iterable
+        Sample IDs to fetch.
+    context : str
+        redbiom context name.
+
+    Returns
+    -------
+    fetch_cache : str
+        Path to the cached biom table (keyed by the samples and context).
+    """
+    key = hashlib.sha1(
+        ('%s\n%s' % ('\n'.join(sorted(ids)), context)).encode()
+    ).hexdigest()[:16]
+    fetch_cache = '%s/%s.biom' % (CACHE, key)
+    return fetch_cache
+
+
+def read_fetch_cache(fetch_cache: str) -> tuple:
+    """
+    Read a cached redbiom fetch.
+
+    Parameters
+    ----------
+    fetch_cache : str
+        Path to the cached biom table.
+
+    Returns
+    -------
+    biom_tab : biom.Table
+        Feature table retrieved from redbiom.
+    json_ambi : dict
+        redbiom ambiguities.
+    """
+    biom_tab = biom.load_table(fetch_cache)
+    json_ambi = read_json_ambiguities_file(fetch_cache)
+    return biom_tab, json_ambi
+
+
+def write_fetch_cache(
+        fetch_cache: str,
+        biom_tab: biom.Table,
+        json_ambi: dict) -> None:
+    """
+    Write a redbiom fetch to the cache.
+
+    Parameters
+    ----------
+    fetch_cache : str
+        Path to the cached biom table.
+    biom_tab : biom.Table
+        Feature table retrieved from redbiom.
+    json_ambi : dict
+        redbiom ambiguities.
+    """
+    os.makedirs(dirname(fetch_cache), exist_ok=True)
+    # write aside and move in place: an interrupted write is never
+    # taken for a cached fetch (the biom, checked for, comes last)
+    fetch_cache_tmp = '%s.%s.tmp' % (fetch_cache, os.getpid())
+    with open(fetch_cache_tmp, 'w') as o:
+        json.dump(json_ambi, o)
+    os.replace(fetch_cache_tmp, '%s.ambiguities' % fetch_cache)
+    write_biom(biom_tab, fetch_cache_tmp)
+    os.replace(fetch_cache_tmp, fetch_cache)
+
+
 def read_json_ambiguities_file(
         redbiom_output: str) -> dict:
     """
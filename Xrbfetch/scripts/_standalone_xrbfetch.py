@@ -40,6 +40,10 @@ from Xrbfetch import __version__
     "-f", "--p-reads-filter", default=1500, show_default=True, type=int,
     help="Minimum number of reads per sample."
 )
+@click.option(
+    "-t", "--p-threads", default=1, show_default=True, type=int,
+    help="Number of concurrent redbiom fetches (on chunks of samples)."
+)
 @click.option(
     "--unique/--no-unique", default=True, show_default=True,
     help="Keep a unique sample per host (most read, or most features)."
@@ -65,6 +69,17 @@ from Xrbfetch import __version__
     "--verbose/--no-verbose", default=False, show_default=True,
     help="Show missing, non-fetched samples and duplicates."
 )
+@click.option(
+    "--compress/--no-compress", default=False, show_default=True,
+    help="Gzip-compress the output biom table (smaller, but slower to write)."
+)
+@click.option(
+    "--cache/--no-cache", default=False, show_default=True,
+    envvar="XRBFETCH_CACHE",
+    help="Re-use the redbiom fetch of the same samples and context stored "
+         "in '~/.cache/xrbfetch' (only for '--simple'; '--force' re-fetches). "
+         "Can also be turned on with the XRBFETCH_CACHE=1 environment variable."
+)
 @click.version_option(__version__, prog_name="Xrbfetch")
 
 
@@ -78,7 +93,10 @@ def standalone_xrbfetch(
         unique, update,
         dim, force,
         simple,
-        verbose
+        verbose,
+        compress,
+        p_threads,
+        cache
 ):
 
     xrbfetch(
@@ -91,7 +109,10 @@ def standalone_xrbfetch(
         unique, update,
         dim, force,
         simple,
-        verbose
+        verbose,
+        compress,
+        p_threads,
+        cache
     )
 
 
@@ -6,16 +6,62 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
-import biom
 from redbiom import fetch
+import numpy as np
 import pandas as pd
-import pkg_resources
 
-from os.path import abspath, isfile
+from concurrent.futures import ThreadPoolExecutor
+from os.path import isfile
 from Xrbfetch.checks import check_fetched_samples, check_replicates_amount
-from Xrbfetch.io import write_summary
+from Xrbfetch.data import BLOOM_SEQUENCES, get_context_length, subset_samples
+from Xrbfetch.io import (
+    get_fetch_cache, read_fetch_cache, write_fetch_cache, open_biom_write,
+    read_bloom_sequences, read_tsv, write_metadata, write_summary
+)
 
-RESOURCES = pkg_resources.resource_filename('Xrbfetch', 'resources')
+
+def fetch_samples(
+        p_redbiom_context: str,
+        ids: set,
+        p_threads: int = 1) -> tuple:
+    """
+    Fetch the samples using the redbiom API,
+    possibly in parallel for chunks of the samples.
+
+    Parameters
+    ----------
+    p_redbiom_context : str
+        Redbiom context for fetching 16S data from Qiita.
+    ids : set
+        Sample IDs to fetch.
+    p_threads : int
+        Number of concurrent redbiom fetches.
+
+    Returns
+    -------
+    tab : biom.Table
+        Feature table retrieved from redbiom.
+    am : dict
+        redbiom ambiguities.
+    """
+    ids = sorted(ids)
+    n_chunks = min(p_threads, len(ids))
+    if n_chunks < 2:
+        return fetch.data_from_samples(p_redbiom_context, ids)
+
+    chunk_size = -(-len(ids) // n_chunks)
+    chunks = [ids[start:start + chunk_size] for start in range(0, len(ids), chunk_size)]
+    # fetching is network-bound: run the chunks concurrently
+    with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+        fetched = list(executor.map(
+            lambda chunk: fetch.data_from_samples(p_redbiom_context, chunk), chunks))
+    # merge the chunks' tables (disjoint samples) and ambiguities
+    tabs = [tab for tab, _ in fetched]
+    tab = tabs[0].concat(tabs[1:], axis='sample')
+    am = {}
+    for _, chunk_am in fetched:
+        am.update(chunk_am)
+    return tab, am
 
 
 def run_simple(
@@ -28,7 +74,10 @@ def run_simple(
         p_reads_filter: int,
         unique: bool,
         force: bool,
-        verbose: bool
+        verbose: bool,
+        compress: bool = False,
+        cache: bool = False,
+        p_threads: int = 1
 ):
     """
     Main script for fetching a metadata's samples on redbiom,
@@ -61,35 +110,47 @@ def run_simple(
     verbose : bool
         Whether to show missing, non-fetched samples
         and duplicates or not.
+    compress : bool
+        Whether to gzip-compress the output biom table or not.
+    cache : bool
+        Whether to re-use (or store) the redbiom fetch of
+        the same samples and context from the local cache.
+    p_threads : int
+        Number of concurrent redbiom fetches (on chunks of samples).
     """
     # -----------
     # Read inputs
     # -----------
     # metadata
-    metadata = pd.read_table(m_metadata_file, dtype=str)
-    metadata.set_index(metadata.columns.tolist()[0], inplace=True)
+    metadata = read_tsv(m_metadata_file, index_col=0)
     # get the sample IDs
     ids = set(metadata.index)
     # bloom sequences
-    bloom_sequences_fp = '%s/newblooms.all.fasta' % RESOURCES
+    bloom_sequences_fp = BLOOM_SEQUENCES
     if p_bloom_sequences:
-        bloom_sequences_fp = abspath(p_bloom_sequences)
+        bloom_sequences_fp = p_bloom_sequences
+    # parse length of sequences to fetch from context to trim blooms accordingly
+    length = get_context_length(p_redbiom_context)
     # read the actual bloom sequences
-    blooms = {s.strip() for s in open(bloom_sequences_fp) if not s.startswith('>')}
-    # parse length of sequences to fetch from context and trim blooms accordingly
-    if p_redbiom_context.split('-')[-2].endswith('nt'):
-        length = int(p_redbiom_context.split('-')[-2][:-2])
-        blooms = {x[:length] for x in blooms}
+    blooms = read_bloom_sequences(bloom_sequences_fp, length)
 
     # ----------------
     # start processing
     # ----------------
-    # perform the fetch using the redbiom API
-    if verbose:
-        print('Fetching %s samples from redbiom... ' % len(ids), end='')
-    tab, am = fetch.data_from_samples(p_redbiom_context, ids)
-    if verbose:
-        print('Done')
+    fetch_cache = get_fetch_cache(ids, p_redbiom_context)
+    if cache and not force and isfile(fetch_cache):
+        if verbose:
+            print('Using the cached fetch of these samples:\n -> %s <-' % fetch_cache)
+        tab, am = read_fetch_cache(fetch_cache)
+    else:
+        # perform the fetch using the redbiom API
+        if verbose:
+            print('Fetching %s samples from redbiom... ' % len(ids), end='')
+        tab, am = fetch_samples(p_redbiom_context, ids, p_threads)
+        if verbose:
+            print('Done')
+        if cache:
+            write_fetch_cache(fetch_cache, tab, am)
     # init summary object with number of samples to fetch
     summary = [['Fetching samples from redbiom', len(ids)]]
 
@@ -108,14 +169,18 @@ def run_simple(
     summary.append(['Get most-reads sample from ambiguous redbiom-fetched samples', tab.shape[1]])
 
     # filter bloom sequences if present on the sample
-    blooms_in = set(tab.ids(axis='observation')) & blooms
-    if blooms_in:
+    n_blooms_in = 0
+    if blooms:
+        obs_ids = tab.ids(axis='observation')
+        is_bloom = pd.Index(obs_ids).isin(blooms)
+        n_blooms_in = is_bloom.sum()
+    if n_blooms_in:
         if verbose:
             print('- Filter blooms... ', end='')
-        tab.filter(set(tab.ids(axis='observation')) - blooms, axis='observation')
+        tab.filter(obs_ids[~is_bloom], axis='observation', inplace=True)
         if verbose:
             print('Done -> %s samples' % tab.shape[1])
-        summary.append(['Filtered %s blooms sequences' % len(blooms_in), tab.shape[1]])
+        summary.append(['Filtered %s blooms sequences' % n_blooms_in, tab.shape[1]])
     elif verbose:
         print('- No bloom sequence to filter')
         summary.append(['No bloom sequence to filter', tab.shape[1]])
@@ -123,36 +188,48 @@ def run_simple(
     # filter sample having too few reads in total
     if verbose:
         print('- Filter biom for min %s reads per sample... ' % p_reads_filter, end='')
-    tab.filter(lambda v, i, m: v.sum() > p_reads_filter)
+    # one reduction of the sparse matrix instead of a callback per sample
+    sums = tab.sum(axis='sample')
+    keep = sums > p_reads_filter
+    # the read counts of the kept samples (filtering keeps their order)
+    reads = pd.Series(sums[keep], index=tab.ids(axis='sample')[keep])
+    if not keep.all():
+        tab.filter(reads.index.values, axis='sample', inplace=True)
     if verbose:
         print('Done -> %s samples' % tab.shape[1])
     summary.append(['Filter biom for min %s reads per sample' % p_reads_filter, tab.shape[1]])
 
-    # get the read counts per sample
-    reads = dict(zip(tab.ids(axis='sample'), tab.sum(axis='sample')))
-
     # subset the metadata to the remaining samples
-    metadata = metadata.loc[set(tab.ids())]
+    metadata = metadata.loc[metadata.index.isin(reads.index)]
 
     if unique:
         # only keep one sample per host for both metadata and data
         if verbose:
             print('- Keep the best sample per "host_subject_id"... ', end='')
-        metadata['temporary_read_counts'] = [reads[x] for x in metadata.index]
-        metadata.sort_values('temporary_read_counts', ascending=False, inplace=True)
-        metadata = metadata[~metadata.host_subject_id.duplicated()]
-        metadata.drop(columns='temporary_read_counts', inplace=True)
-        tab.filter(set(metadata.index)).remove_empty()
+        read_counts = reads.reindex(metadata.index).values
+        # integer code per host (+1: missing host IDs all share the code 0)
+        host_codes, hosts = pd.factorize(metadata['host_subject_id'].values)
+        host_codes += 1
+        # max reads per host, in one unbuffered scan
+        best_reads = np.full(len(hosts) + 1, -np.inf)
+        np.maximum.at(best_reads, host_codes, read_counts)
+        # first sample reaching its host's max reads
+        best_samples = np.flatnonzero(read_counts == best_reads[host_codes])
+        best_samples = best_samples[
+            ~pd.Series(host_codes[best_samples]).duplicated().values]
+        metadata = metadata.iloc[best_samples]
+        # also drops the features left empty by the reads filter
+        tab = subset_samples(tab, metadata.index.values)
         if verbose:
             print('Done -> %s samples' % tab.shape[1])
         summary.append(['Keep the best sample per "host_subject_id"', tab.shape[1]])
 
     if not isfile(o_biom_file) or force:
-        with biom.util.biom_open(o_biom_file, 'w') as o_biom_file_handle:
-            tab.to_hdf5(o_biom_file_handle, 'custom')
+        with open_biom_write(o_biom_file) as o_biom_file_handle:
+            tab.to_hdf5(o_biom_file_handle, 'custom', compress=compress)
 
     if not isfile(o_metadata_file) or force:
-        metadata.to_csv(o_metadata_file, index=True, sep='\t')
+        write_metadata(metadata, o_metadata_file, index=True)
 
     write_summary(o_summary_file, summary)
 
@@ -7,11 +7,15 @@
 # ----------------------------------------------------------------------------
 
 import os
+import tempfile
 import unittest
-import pkg_resources
+from io import StringIO
+from contextlib import redirect_stdout
 import pandas as pd
 import numpy as np
 from biom.table import Table
+from os.path import abspath, dirname, splitext
+from unittest.mock import patch
 
 from pandas.testing import assert_frame_equal
 
@@ -19,26 +23,37 @@ from Xrbfetch.data import (
     merge_read_features_counts,
     run_redbiom_fetch,
     filter_reads,
+    subset_samples,
     update_sample_name,
     remove_blooms,
     get_reads_features_counts,
-    reverse_json_ambi,
-    get_most_read_or_features,
-    solve_ambiguous_preps
+    get_best_ambiguous_samples,
+    solve_ambiguous_preps,
+    get_context_length
 )
 
-ROOT = pkg_resources.resource_filename('Xrbfetch', 'tests')
+ROOT = dirname(abspath(__file__))
 
 
 class TestData(unittest.TestCase):
 
+    @classmethod
+    def setUpClass(cls):
+        # read-only input metadata: written once for all the tests
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.metadata = pd.DataFrame({'sample_name': ['10317.000001778']})
+        cls.m_metadata_file = '%s/test.tsv' % cls.tmp_dir.name
+        cls.o_metadata_file = '%s/test_out.tsv' % cls.tmp_dir.name
+        cls.metadata.to_csv(cls.m_metadata_file, index=False, sep='\t')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
     def setUp(self):
 
-        self.metadata = pd.DataFrame({'sample_name': ['10317.000001778']})
-        self.m_metadata_file = '%s/samples/test.tsv' % ROOT
-        self.metadata.to_csv(self.m_metadata_file, index=False, sep='\t')
-        self.redbiom_output = '%s/samples/test_redbiom.biom' % ROOT
-        self.redbiom_output_amb = '%s/samples/test_redbiom.biom.ambiguities' % ROOT
+        self.redbiom_output = '%s/test_redbiom.biom' % self.tmp_dir.name
+        self.redbiom_output_amb = '%s/test_redbiom.biom.ambiguities' % self.tmp_dir.name
         self.bloom_sequences = '%s/samples/seqs.fasta' % ROOT
         self.context = 'Deblur-Illumina-16S-V4-150nt-780653'
 
@@ -68,10 +83,10 @@ class TestData(unittest.TestCase):
 
         self.biom_with_bloom_1nt = Table(
             np.array([[1, 1, 1], [1, 1, 0]]),
-            ['CC', 'TT'], ['a', 'b', 'c'])
+            ['C', 'T'], ['a', 'b', 'c'])
         self.biom_with_bloom_2nt = Table(
             np.array([[1, 1, 1], [1, 1, 0]]),
-            ['C', 'T'], ['a', 'b', 'c'])
+            ['CC', 'TT'], ['a', 'b', 'c'])
         self.biom_with_nobloom_1nt = Table(
             np.array([[1, 1]]),
             ['T'], ['a', 'b'])
@@ -82,16 +97,20 @@ class TestData(unittest.TestCase):
 
         self.reads_filter = 1000
 
-    def test_run_redbiom_fetch(self):
-        redbiom_output = run_redbiom_fetch(self.metadata, self.m_metadata_file, self.context, False)
-        self.assertEqual(self.redbiom_output, redbiom_output)
-        self.assertTrue(os.path.isfile(redbiom_output))
-        redbiom_output = run_redbiom_fetch(self.metadata, self.m_metadata_file, self.context, True)
-        self.assertEqual(self.redbiom_output, redbiom_output)
-        self.assertTrue(os.path.isfile(redbiom_output))
-        redbiom_output = run_redbiom_fetch(self.metadata, self.m_metadata_file, self.context, False)
-        self.assertEqual(self.redbiom_output, redbiom_output)
+    @patch('Xrbfetch.data.run_fetch')
+    def test_run_redbiom_fetch(self, mock_run_fetch):
+        # no network: the fetch only creates the biom file
+        mock_run_fetch.side_effect = lambda sams, context, output, threads: open(output, 'w').close()
+        redbiom_output, redbiom_samples = run_redbiom_fetch(
+            self.metadata, self.m_metadata_file, self.o_metadata_file, self.context, False)
+        self.assertTrue(redbiom_output.startswith(
+            '%s_redbiom_%s_' % (splitext(self.o_metadata_file)[0], self.context)))
         self.assertTrue(os.path.isfile(redbiom_output))
+        mock_run_fetch.assert_called_once_with(redbiom_samples, self.context, redbiom_output, 1)
+        with open(redbiom_samples) as f:
+            self.assertEqual(f.read(), '10317.000001778\n')
+        os.remove(redbiom_output)
+        os.remove(redbiom_samples)
 
     def test_filter_reads(self):
         biom_tab_filt, metadata_filt = filter_reads(
@@ -99,6 +118,12 @@ class TestData(unittest.TestCase):
         self.assertEqual(biom_tab_filt, self.biom_tab_no_ambi_out)
         assert_frame_equal(metadata_filt, self.metadata_counts_out)
 
+    def test_subset_samples(self):
+        biom_tab = subset_samples(self.biom_tab_no_ambi, ['b.2.y', 'c.3.z'])
+        self.assertEqual(biom_tab, self.biom_tab_no_ambi_out)
+        biom_tab = subset_samples(self.biom_tab_no_ambi, {'a.1.x', 'b.2.y', 'c.3.z'})
+        self.assertEqual(biom_tab, self.biom_tab_no_ambi)
+
     def test_merge_read_features_counts(self):
         metadata_counts = merge_read_features_counts(
             self.metadata_counts, self.biom_tab_no_ambi,
@@ -106,6 +131,11 @@ class TestData(unittest.TestCase):
         )
         assert_frame_equal(self.metadata_counts_merge, metadata_counts)
 
+    def test_get_context_length(self):
+        self.assertEqual(get_context_length(self.context), 150)
+        self.assertEqual(get_context_length('Deblur-Illumina-16S-V4-90nt-99d1d8'), 90)
+        self.assertIsNone(get_context_length('Pick_closed-reference_OTUs-Greengenes-Illumina-16S-V4-5c6506'))
+
     def test_update_sample_name(self):
         biom_tab_no_ambi_out_updated = update_sample_name(False, self.biom_tab_no_ambi_out)
         self.assertEqual(biom_tab_no_ambi_out_updated, self.biom_tab_no_ambi_out)
@@ -126,53 +156,50 @@ class TestData(unittest.TestCase):
     def test_get_reads_features_counts(self):
         # because the counts are dummy counts set to 1; reads counts = features counts...
         read_counts, feat_counts = get_reads_features_counts(self.biom_tab_no_ambi)
-        self.assertEqual(read_counts, {'a.1.x': 3, 'b.2.y': 2, 'c.3.z': 2})
-        self.assertEqual(feat_counts, {'a.1.x': 3, 'b.2.y': 2, 'c.3.z': 2})
+        self.assertEqual(read_counts.to_dict(), {'a.1.x': 3, 'b.2.y': 2, 'c.3.z': 2})
+        self.assertEqual(feat_counts.to_dict(), {'a.1.x': 3, 'b.2.y': 2, 'c.3.z': 2})
         read_counts, feat_counts = get_reads_features_counts(self.biom_tab_no_ambi_out)
-        self.assertEqual(read_counts, {'b.2.y': 2, 'c.3.z': 2})
-        self.assertEqual(feat_counts, {'b.2.y': 2, 'c.3.z': 2})
+        self.assertEqual(read_counts.to_dict(), {'b.2.y': 2, 'c.3.z': 2})
+        self.assertEqual(feat_counts.to_dict(), {'b.2.y': 2, 'c.3.z': 2})
         read_counts, feat_counts = get_reads_features_counts(self.biom_tab_no_ambi_out_updated)
-        self.assertEqual(read_counts, {'b.2': 2, 'c.3': 2})
-        self.assertEqual(feat_counts, {'b.2': 2, 'c.3': 2})
+        self.assertEqual(read_counts.to_dict(), {'b.2': 2, 'c.3': 2})
+        self.assertEqual(feat_counts.to_dict(), {'b.2': 2, 'c.3': 2})
         read_counts, feat_counts = get_reads_features_counts(
             self.biom_with_bloom_2nt)
-        self.assertEqual(read_counts, {'a': 2, 'b': 2, 'c': 1})
-        self.assertEqual(feat_counts, {'a': 2, 'b': 2, 'c': 1})
+        self.assertEqual(read_counts.to_dict(), {'a': 2, 'b': 2, 'c': 1})
+        self.assertEqual(feat_counts.to_dict(), {'a': 2, 'b': 2, 'c': 1})
         read_counts, feat_counts = get_reads_features_counts(
-            self.biom_with_bloom_2nt)
-        self.assertEqual(read_counts, {'a': 1, 'b': 1})
-        self.assertEqual(feat_counts, {'a': 1, 'b': 1})
+            self.biom_with_nobloom_1nt)
+        self.assertEqual(read_counts.to_dict(), {'a': 1, 'b': 1})
+        self.assertEqual(feat_counts.to_dict(), {'a': 1, 'b': 1})
 
-    def test_reverse_json_ambi(self):
+    def test_get_best_ambiguous_samples(self):
+        json_ambi = {'a.1': 'a', 'a.2': 'a', 'b.1': 'b', 'c.1': 'c'}
+        ids = {'a.1', 'a.2', 'b.1'}
+        read_counts = {'a.1': 1, 'a.2': 2, 'b.1': 1}
+        feat_counts = {'a.1': 2, 'a.2': 1, 'b.1': 1}
+        best = get_best_ambiguous_samples(json_ambi, ids, read_counts, feat_counts)
+        self.assertEqual(sorted(best), ['a.2', 'b.1'])
 
-        rev_json = reverse_json_ambi({'a': '1', 'b': '1', 'c': '2'}, set())
-        self.assertEqual(rev_json, {'1': ['a', 'b'], '2': ['c']})
-        rev_json = reverse_json_ambi({'a': '1', 'b': '2', 'c': '3'}, set())
-        self.assertEqual(rev_json, {'1': ['a'], '2': ['b'], '3': ['c']})
+        read_counts = {'a.1': 2, 'a.2': 2, 'b.1': 1}
+        best = get_best_ambiguous_samples(json_ambi, ids, read_counts, feat_counts)
+        self.assertEqual(sorted(best), ['a.1', 'b.1'])
 
-        rev_json = reverse_json_ambi({'a': '1', 'b': '1', 'c': '2'}, {'a'})
-        self.assertEqual(rev_json, {'1': ['b'], '2': ['c']})
-        rev_json = reverse_json_ambi({'a': '1', 'b': '2', 'c': '3'}, {'b'})
-        self.assertEqual(rev_json, {'1': ['a'], '3': ['c']})
-        rev_json = reverse_json_ambi({'a': '1', 'b': '2', 'c': '3'}, {'a', 'b'})
-        self.assertEqual(rev_json, {'3': ['c']})
+        feat_counts = {'a.1': 1, 'a.2': 1, 'b.1': 1}
+        best = get_best_ambiguous_samples(json_ambi, ids, read_counts, feat_counts)
+        self.assertEqual(sorted(best), ['a.1', 'b.1'])
 
-    def test_get_most_read_or_features(self):
-        sams = get_most_read_or_features(['a.1', 'a.2'],  {'a.1': 1, 'a.2': 2})
-        self.assertEqual(sams, ['a.2'])
-        sams = get_most_read_or_features(['a.1', 'a.2', 'a.3'], {'a.1': 1, 'a.2': 2, 'a.3': 2})
-        self.assertEqual(sams, ['a.2', 'a.3'])
+        best = get_best_ambiguous_samples({}, ids, read_counts, feat_counts)
+        self.assertEqual(best, [])
 
     def tearDown(self):
         if os.path.isfile(self.redbiom_output):
             os.remove(self.redbiom_output)
         if os.path.isfile(self.redbiom_output_amb):
             os.remove(self.redbiom_output_amb)
-        if os.path.isfile(self.m_metadata_file):
-            os.remove(self.m_metadata_file)
 
 
-class TestData(unittest.TestCase):
+class TestAmbiguities(unittest.TestCase):
 
     def setUp(self):
         self.ambiguities_json = '%s/ambiguities/json' % ROOT
@@ -205,6 +232,15 @@ class TestData(unittest.TestCase):
             self.read_counts_equal, self.feat_counts)
         self.assertEqual(biom_noprep, self.biom_equal)
 
+        # no ambiguous sample in the table: no ambiguities reported
+        biom_other = Table(np.array([[1], [1]]), ['sp1', 'sp2'], ["10317.1.1"])
+        with redirect_stdout(StringIO()) as out:
+            biom_noprep = solve_ambiguous_preps(
+                self.ambiguities_json, biom_other.copy(),
+                self.read_counts_diff, self.feat_counts)
+        self.assertNotIn('ambiguous redbiom results', out.getvalue())
+        self.assertEqual(biom_noprep, biom_other)
+
 
 if __name__ == '__main__':
     unittest.main()
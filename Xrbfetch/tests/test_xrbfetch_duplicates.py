@@ -8,9 +8,9 @@
 
 import os
 import unittest
-import pkg_resources
 import pandas as pd
 from biom.table import Table
+from os.path import abspath, dirname
 
 from pandas.testing import assert_frame_equal
 
@@ -19,13 +19,14 @@ from Xrbfetch.duplicates import (
     keep_the_best_host_subject_id_sample
 )
 
-ROOT = pkg_resources.resource_filename('Xrbfetch', 'tests')
+ROOT = dirname(abspath(__file__))
 
 
 class TestData(unittest.TestCase):
     def setUp(self):
         self.metadata_digit = pd.DataFrame({'orig_sample_name': ['1.01.1']})
         self.metadata_nodigit = pd.DataFrame({'orig_sample_name': ['1.01A.1']})
+        self.metadata_blank = pd.DataFrame({'orig_sample_name': ['10317.BLANK1.57016']})
 
         self.metadata_hosts_reads = pd.DataFrame({'sample_name': ['1', '2', '3'],
                                                   'host_subject_id': ['a', 'a', 'b'],
@@ -47,12 +48,16 @@ class TestData(unittest.TestCase):
         assert_frame_equal(metadata_nodigit, pd.DataFrame({'orig_sample_name': ['1.01A.1'],
                                                            'edit_sample_name': ['1.01.1'],
                                                            'working_sample_name': ['1']}))
+        metadata_blank = add_edit_and_working_sample_name(self.metadata_blank)
+        assert_frame_equal(metadata_blank, pd.DataFrame({'orig_sample_name': ['10317.BLANK1.57016'],
+                                                         'edit_sample_name': ['10317.BLANK.57016'],
+                                                         'working_sample_name': ['BLANK']}))
 
     def test_keep_the_best_host_subject_id_sample(self):
         metadata_hosts_reads = keep_the_best_host_subject_id_sample(self.metadata_hosts_reads)
         metadata_hosts_feats = keep_the_best_host_subject_id_sample(self.metadata_hosts_feats)
-        assert_frame_equal(metadata_hosts_reads, self.metadata_hosts_reads)
-        assert_frame_equal(metadata_hosts_feats, self.metadata_hosts_feats)
+        assert_frame_equal(metadata_hosts_reads, self.metadata_hosts_reads_out)
+        assert_frame_equal(metadata_hosts_feats, self.metadata_hosts_feats_out)
 
 
 if __name__ == '__main__':
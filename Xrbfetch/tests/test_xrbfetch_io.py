@@ -7,24 +7,34 @@
 # ----------------------------------------------------------------------------
 
 import os
+import json
+import biom
+import tempfile
 import unittest
-import pkg_resources
 import pandas as pd
 import numpy as np
 from biom.table import Table
+from os.path import abspath, dirname
+from unittest.mock import patch
 
 from pandas.testing import assert_frame_equal
 from Xrbfetch.io import (
     read_meta_pd,
+    read_tsv,
+    read_bloom_sequences,
     run_fetch,
     delete_files,
     write_summary,
     make_samples_list_tmp,
     get_outputs,
-    write_outputs
+    write_outputs,
+    write_metadata,
+    get_fetch_cache,
+    read_fetch_cache,
+    write_fetch_cache
 )
 
-ROOT = pkg_resources.resource_filename('Xrbfetch', 'tests')
+ROOT = dirname(abspath(__file__))
 
 
 class TestMd(unittest.TestCase):
@@ -47,6 +57,33 @@ class TestMd(unittest.TestCase):
         md_missing_fp = '%s/metadata/test_md/md_missing.tsv' % ROOT
         md_missing = read_meta_pd(md_missing_fp)
         assert_frame_equal(md_missing, self.md_res)
+        # values are kept as written (no float/int parsing)
+        md_ids_fp = '%s/metadata/test_md/md_ids.tsv' % ROOT
+        md_ids = read_meta_pd(md_ids_fp)
+        assert_frame_equal(md_ids, pd.DataFrame({
+            'sample_name': ['10317.000001230', '10317.000001240'],
+            'host_subject_id': ['007', '008']
+        }))
+
+    def test_read_tsv(self):
+        md_ids_fp = '%s/metadata/test_md/md_ids.tsv' % ROOT
+        md_ids = read_tsv(md_ids_fp, index_col=0)
+        self.assertEqual(md_ids.index.name, 'sample_name')
+        self.assertEqual(md_ids.index.tolist(), ['10317.000001230', '10317.000001240'])
+        self.assertEqual(md_ids['host_subject_id'].tolist(), ['007', '008'])
+
+
+class TestBlooms(unittest.TestCase):
+
+    def setUp(self):
+        self.bloom_sequences = '%s/samples/seqs.fasta' % ROOT
+
+    def test_read_bloom_sequences(self):
+        bloom_seqs = read_bloom_sequences(self.bloom_sequences)
+        self.assertEqual(bloom_seqs, frozenset({'CC'}))
+        bloom_seqs = read_bloom_sequences(self.bloom_sequences, 1)
+        self.assertEqual(bloom_seqs, frozenset({'C'}))
+        self.assertIs(read_bloom_sequences(self.bloom_sequences, 1), bloom_seqs)
 
 
 class TestRun(unittest.TestCase):
@@ -70,6 +107,56 @@ class TestRun(unittest.TestCase):
             os.remove(self.redbiom_output_amb)
 
 
+def fake_fetch_cmd(redbiom_samples, context, redbiom_output):
+    # one feature per fetched sample, and its ambiguity
+    with open(redbiom_samples) as f:
+        samples = [x.strip() for x in f]
+    tab = Table(np.ones((1, len(samples))), ['f'], ['%s.1' % x for x in samples])
+    with biom.util.biom_open(redbiom_output, 'w') as o:
+        tab.to_hdf5(o, 'test')
+    with open('%s.ambiguities' % redbiom_output, 'w') as o:
+        json.dump({'%s.1' % x: x for x in samples}, o)
+    return ['redbiom', 'fetch', 'samples', '--from', redbiom_samples]
+
+
+class TestRunChunks(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.redbiom_samples = '%s/redbiom_samples.tmp' % self.tmp_dir.name
+        self.redbiom_output = '%s/redbiom_samples.biom' % self.tmp_dir.name
+        with open(self.redbiom_samples, 'w') as o:
+            o.write('a\nb\nc\n')
+        self.context = 'Deblur-Illumina-16S-V4-150nt-780653'
+
+    @patch('Xrbfetch.io.fetch_cmd', side_effect=fake_fetch_cmd)
+    def test_run_fetch_chunks(self, mock_fetch_cmd):
+        run_fetch(self.redbiom_samples, self.context, self.redbiom_output, 2)
+        self.assertEqual(mock_fetch_cmd.call_count, 2)
+        tab = biom.load_table(self.redbiom_output)
+        self.assertEqual(sorted(tab.ids()), ['a.1', 'b.1', 'c.1'])
+        with open('%s.ambiguities' % self.redbiom_output) as f:
+            self.assertEqual(json.load(f), {'a.1': 'a', 'b.1': 'b', 'c.1': 'c'})
+        # only the samples list and the merged outputs remain
+        self.assertEqual(sorted(os.listdir(self.tmp_dir.name)), [
+            'redbiom_samples.biom', 'redbiom_samples.biom.ambiguities',
+            'redbiom_samples.tmp'])
+
+    @patch('Xrbfetch.io.fetch_cmd', side_effect=fake_fetch_cmd)
+    def test_run_fetch_chunks_missing(self, mock_fetch_cmd):
+        def fail_second(redbiom_samples, context, redbiom_output):
+            if redbiom_output.endswith('_1.biom'):
+                return ['redbiom']
+            return fake_fetch_cmd(redbiom_samples, context, redbiom_output)
+        mock_fetch_cmd.side_effect = fail_second
+        with self.assertRaises(IOError):
+            run_fetch(self.redbiom_samples, self.context, self.redbiom_output, 2)
+        self.assertEqual(os.listdir(self.tmp_dir.name), ['redbiom_samples.tmp'])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
 class TestIO(unittest.TestCase):
 
     def setUp(self):
@@ -110,6 +197,35 @@ class TestIO(unittest.TestCase):
         self.assertEqual(redbiom_samples_temp, ['a\n', 'b\n'])
         self.assertEqual(redbiom_samples, self.redbiom_samples_temp)
 
+    def test_write_metadata(self):
+        metadata = pd.DataFrame({
+            'sample_name': ['a', 'b'], 'flag': [True, False],
+            'value': [1.0, np.nan], 'text': ['x y', 'x,y']})
+        write_metadata(metadata, self.o_metadata_file)
+        with open(self.o_metadata_file) as f:
+            self.assertEqual(f.read(), metadata.to_csv(index=False, sep='\t'))
+        metadata = metadata.set_index('sample_name')
+        write_metadata(metadata, self.o_metadata_file, index=True)
+        with open(self.o_metadata_file) as f:
+            self.assertEqual(f.read(), metadata.to_csv(index=True, sep='\t'))
+
+    def test_get_fetch_cache(self):
+        fetch_cache = get_fetch_cache({'b', 'a'}, 'context')
+        self.assertEqual(fetch_cache, get_fetch_cache(['a', 'b'], 'context'))
+        self.assertNotEqual(fetch_cache, get_fetch_cache(['a', 'b'], 'other_context'))
+        self.assertNotEqual(fetch_cache, get_fetch_cache(['a'], 'context'))
+        self.assertTrue(fetch_cache.endswith('.biom'))
+
+    def test_write_read_fetch_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fetch_cache = '%s/cache/key.biom' % tmp_dir
+            write_fetch_cache(fetch_cache, self.biom_table, {'s1.1': 's1'})
+            self.assertEqual(sorted(os.listdir(dirname(fetch_cache))),
+                             ['key.biom', 'key.biom.ambiguities'])
+            biom_tab, json_ambi = read_fetch_cache(fetch_cache)
+        self.assertEqual(biom_tab, self.biom_table)
+        self.assertEqual(json_ambi, {'s1.1': 's1'})
+
     def test_get_outputs(self):
         o_metadata_file, o_biom_file = get_outputs(
             self.metadata, self.redbiom_samples, self.redbiom_output)
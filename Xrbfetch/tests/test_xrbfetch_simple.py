@@ -0,0 +1,106 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020, Franck Lejzerowicz.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import biom
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from biom.table import Table
+from os.path import abspath, dirname
+from unittest.mock import patch
+
+from Xrbfetch.simple import fetch_samples, run_simple
+
+ROOT = dirname(abspath(__file__))
+
+
+class TestSimple(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.m_metadata_file = '%s/md.tsv' % self.tmp_dir.name
+        self.o_metadata_file = '%s/md_out.tsv' % self.tmp_dir.name
+        self.o_summary_file = '%s/md_out_summary.tsv' % self.tmp_dir.name
+        self.o_biom_file = '%s/out.biom' % self.tmp_dir.name
+        pd.DataFrame({
+            'sample_name': ['a', 'b', 'c'],
+            'host_subject_id': ['h1', 'h2', 'h3']
+        }).to_csv(self.m_metadata_file, index=False, sep='\t')
+        self.context = 'Deblur-Illumina-16S-V4-150nt-780653'
+        self.bloom_sequences = '%s/samples/seqs.fasta' % ROOT
+        # 'f3' is only in sample 'c', which has too few reads
+        self.tab = Table(
+            np.array([[5, 5, 1], [5, 5, 0], [0, 0, 1]]),
+            ['f1', 'f2', 'f3'], ['a.1', 'b.1', 'c.1'])
+        self.am = {'a.1': 'a', 'b.1': 'b', 'c.1': 'c'}
+
+    @patch('Xrbfetch.simple.fetch.data_from_samples')
+    def test_run_simple_unique(self, mock_fetch):
+        mock_fetch.return_value = (self.tab, self.am)
+        run_simple(
+            self.m_metadata_file, self.o_metadata_file, self.o_summary_file,
+            self.o_biom_file, self.context, self.bloom_sequences,
+            5, True, False, False)
+        tab = biom.load_table(self.o_biom_file)
+        # one sample per host already: the empty feature is still removed
+        self.assertEqual(tab.shape, (2, 2))
+        self.assertEqual(sorted(tab.ids(axis='observation')), ['f1', 'f2'])
+        self.assertEqual(sorted(tab.ids(axis='sample')), ['a', 'b'])
+        with open(self.o_metadata_file) as f:
+            self.assertEqual(f.read(), 'sample_name\thost_subject_id\n'
+                                       'a\th1\nb\th2\n')
+
+    @patch('Xrbfetch.simple.fetch.data_from_samples')
+    def test_run_simple_unique_hosts(self, mock_fetch):
+        # 'h1': most reads in 'b', 'h2': tie, no host: most reads in 'f'
+        with open(self.m_metadata_file, 'w') as o:
+            o.write('sample_name\thost_subject_id\n'
+                    'a\th1\nb\th1\nc\th2\nd\th2\ne\t\nf\t\ng\th3\n')
+        samples = ['a', 'b', 'c', 'd', 'e', 'f', 'g']
+        # 'f2' is only in 'a', which is not the best sample of 'h1'
+        tab = Table(
+            np.array([[9, 20, 15, 15, 12, 30, 8], [1, 0, 0, 0, 0, 0, 0]]),
+            ['f1', 'f2'], ['%s.1' % x for x in samples])
+        mock_fetch.return_value = (tab, {'%s.1' % x: x for x in samples})
+        run_simple(
+            self.m_metadata_file, self.o_metadata_file, self.o_summary_file,
+            self.o_biom_file, self.context, self.bloom_sequences,
+            5, True, False, False)
+        tab = biom.load_table(self.o_biom_file)
+        self.assertEqual(list(tab.ids(axis='observation')), ['f1'])
+        kept = set(tab.ids(axis='sample'))
+        self.assertEqual(len(kept), 4)
+        self.assertTrue({'b', 'f', 'g'}.issubset(kept))
+        self.assertEqual(len(kept & {'c', 'd'}), 1)
+        metadata = pd.read_csv(self.o_metadata_file, sep='\t', dtype=str)
+        self.assertEqual(set(metadata.sample_name), kept)
+
+    @patch('Xrbfetch.simple.fetch.data_from_samples')
+    def test_fetch_samples_chunks(self, mock_fetch):
+        def fetch_chunk(context, chunk):
+            # the chunks have features in common and their own features
+            return (
+                self.tab.filter(['%s.1' % x for x in chunk],
+                                inplace=False).remove_empty(),
+                {'%s.1' % x: x for x in chunk})
+        mock_fetch.side_effect = fetch_chunk
+        tab, am = fetch_samples(self.context, {'c', 'a', 'b'}, 2)
+        self.assertEqual(mock_fetch.call_count, 2)
+        self.assertEqual(sorted(call[0][1] for call in mock_fetch.call_args_list),
+                         [['a', 'b'], ['c']])
+        self.assertEqual(am, self.am)
+        self.assertEqual(tab.sort_order(self.tab.ids()).sort_order(
+            self.tab.ids(axis='observation'), axis='observation'), self.tab)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
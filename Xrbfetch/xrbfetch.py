@@ -7,19 +7,16 @@
 # ----------------------------------------------------------------------------
 
 from os.path import abspath, splitext
-import pkg_resources
 
 from Xrbfetch.simple import run_simple
 from Xrbfetch.io import read_meta_pd, read_biom, write_outputs
 from Xrbfetch.data import (
     run_redbiom_fetch, remove_blooms, get_reads_features_counts, solve_ambiguous_preps,
-    merge_read_features_counts, filter_reads, update_sample_name
+    merge_read_features_counts, filter_reads, update_sample_name, get_context_length
 )
 from Xrbfetch.checks import check_fetched_samples, check_replicates_amount, potential_stop
 from Xrbfetch.duplicates import remove_duplicates
 
-RESOURCES = pkg_resources.resource_filename('Xrbfetch', 'resources')
-
 
 def xrbfetch(
         m_metadata_file: str,
@@ -30,10 +27,13 @@ def xrbfetch(
         p_reads_filter: int,
         unique: bool,
         update: bool,
-        dim: bool,
-        force: bool,
-        simple: bool,
-        verbose: bool) -> None:
+        dim: bool = False,
+        force: bool = False,
+        simple: bool = False,
+        verbose: bool = False,
+        compress: bool = False,
+        p_threads: int = 1,
+        cache: bool = False) -> None:
     """
     Main script for fetching a metadata's samples on redbiom and then,
     filtering the retrieved samples to keep only the "best" in terms of
@@ -70,6 +70,14 @@ def xrbfetch(
     verbose : bool
         Whether to show missing, non-fetched samples
         and duplicates or not.
+    compress : bool
+        Whether to gzip-compress the output biom table or not.
+    p_threads : int
+        Number of concurrent redbiom fetches (on chunks of samples).
+    cache : bool
+        Whether to re-use (or store) the redbiom fetch of the
+        same samples and context from ~/.cache/xrbfetch or not
+        (only for the simple mode).
     """
 
     # Read metadata with first column as index.
@@ -77,20 +85,23 @@ def xrbfetch(
     o_metadata_file = abspath(o_metadata_file)
     o_summary_file = '%s_summary.tsv' % splitext(o_metadata_file)[0]
     o_biom_file = abspath(o_biom_file)
+    if p_bloom_sequences and p_bloom_sequences != 'no':
+        p_bloom_sequences = abspath(p_bloom_sequences)
 
     if simple:
         # added as per suggestions from Daniel
         run_simple(
             m_metadata_file, o_metadata_file, o_summary_file,
             o_biom_file, p_redbiom_context, p_bloom_sequences,
-            p_reads_filter, unique, force, verbose
+            p_reads_filter, unique, force, verbose, compress, cache, p_threads
         )
     else:
         metadata = read_meta_pd(m_metadata_file)
         summary = [['Fetching samples from redbiom', metadata['sample_name'].nunique()]]
         # Fetch the samples using redbiom
         redbiom_output, redbiom_samples = run_redbiom_fetch(
-            metadata, m_metadata_file, o_metadata_file, p_redbiom_context, force)
+            metadata, m_metadata_file, o_metadata_file, p_redbiom_context,
+            force, p_threads)
 
         # Read biom file and show non fetched samples and replication amount
         biom_tab = read_biom(redbiom_output)
@@ -103,7 +114,7 @@ def xrbfetch(
 
         # Remove the bloom sequences from the fetched samples.
         if p_bloom_sequences != 'no':
-            length = int(p_redbiom_context.split('-')[-2][:-2])
+            length = get_context_length(p_redbiom_context)
             biom_tab = remove_blooms(length, biom_tab, p_bloom_sequences)
             summary.append(['Filtered blooms sequences', biom_tab.shape[1]])
         potential_stop(biom_tab, o_summary_file, summary, redbiom_output, redbiom_samples)
@@ -139,6 +150,6 @@ def xrbfetch(
         # write the metadata and the biom table outputs
         write_outputs(
             o_biom_file, o_metadata_file, biom_updated,
-            metadata_edit_best, dim)
+            metadata_edit_best, dim, compress)
 
         potential_stop(biom_tab, o_summary_file, summary, redbiom_output, redbiom_samples, True)
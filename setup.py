@@ -55,7 +55,8 @@ setup(
         'numpy >= 1.12.1',
         'cython >= 0.29.15',
         'redbiom >= 0.3.5',
-        'biom-format >= 2.1.5'
+        'biom-format >= 2.1.7',
+        'h5py >= 2.9'
     ],
     classifiers=classifiers,
     entry_points={'console_scripts': standalone},